@@ -1,13 +1,28 @@
-import time
 import curses
 import threading
-import queue
+from collections import deque
 from configparser import ConfigParser, NoOptionError
 import serial
 import sys
 import argparse
 import logging
 import signal
+import re
+import os
+import select
+
+# Runs of bytes that are drawn as-is in the normal output state
+PRINTABLE_RUN = re.compile(b'[\x00\x20-\x7E]+')
+NUL_TO_MIDDLE_DOT = bytes.maketrans(b'\x00', b'\xB7')
+
+# The string drawn for each byte
+CHR_TABLE = [chr(i) for i in range(256)]
+CHR_TABLE[0x00] = '\u00B7' # · Middle Dot
+CHR_TABLE = tuple(CHR_TABLE)
+DARK_SHADE = '\u2593' # ▓ Dark Shade
+
+# Single byte bytes objects, for writing one byte without allocating
+BYTE_TABLE = tuple(bytes((i,)) for i in range(256))
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -49,7 +64,16 @@ class Device(object):
     def readByte(self):
         pass
 
+    def readAvailable(self, max_n=4096):
+        pass
+
+    def readBlock(self, timeout, max_n=4096):
+        pass
+
     def cancelRead(self):
+        self.wakeRead()
+
+    def wakeRead(self):
         pass
 
 class SerialDevice(Device):
@@ -57,6 +81,9 @@ class SerialDevice(Device):
         super(SerialDevice, self).setup()
 
         self.serial = None
+        self._fd = None
+        self._wake_r = None
+        self._wake_w = None
 
         if 'url' in self.config:
             try:
@@ -70,6 +97,7 @@ class SerialDevice(Device):
             except serial.SerialException as e:
                 self.enabled = False
                 self.handleException(e)
+                return
         else:
             try:
                 self.serial = serial.serial_for_url(
@@ -94,6 +122,19 @@ class SerialDevice(Device):
             except serial.SerialException as e:
                 self.enabled = False
                 self.handleException(e)
+                return
+
+        # Ports backed by a file descriptor are waited on with select,
+        # along with a pipe that wakeRead writes to
+        if os.name == 'posix':
+            try:
+                self._fd = self.serial.fileno()
+            except OSError:
+                # URL handlers without a descriptor, e.g. loop:// or rfc2217://
+                return
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_r, False)
+            os.set_blocking(self._wake_w, False)
 
     def close(self):
         try:
@@ -102,6 +143,11 @@ class SerialDevice(Device):
         except serial.SerialException as e:
             self.handleException(e)
 
+        if self._wake_r is not None:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = self._wake_w = None
+
     def writeBytes(self, bytes):
         try:
             self.serial.write(bytes)
@@ -109,7 +155,7 @@ class SerialDevice(Device):
             self.handleException(e)
     
     def writeByte(self, byte):
-        self.writeBytes(byte.to_bytes(1, 'little'))
+        self.writeBytes(BYTE_TABLE[byte])
 
     def readBytes(self, num):
         if self.enabled:
@@ -121,39 +167,115 @@ class SerialDevice(Device):
     
     def readByte(self):
         bytes = self.readBytes(1)
-        if bytes is None or len(bytes) == 0:
+        if not bytes:
             return -1
-        return int.from_bytes(bytes, 'little')
+        return bytes[0]
 
-    def cancelRead(self):
+    def readAvailable(self, max_n=4096):
+        # Block for at least one byte, then take whatever else is waiting
         if self.enabled:
             try:
-                if hasattr(self.serial, 'cancel_read'):
-                    self.serial.cancel_read()        
+                b = self.serial.read(1)
+                n = self.serial.in_waiting
+                if b and n:
+                    b += self.serial.read(min(n, max_n - 1))
+                return b
             except serial.SerialException as e:
                 self.enabled = False
                 self.handleException(e)
+        return b''
+
+    def readBlock(self, timeout, max_n=4096):
+        # Wait up to timeout for data, then drain what has arrived
+        if self._fd is None:
+            return self.readAvailable(max_n)
+
+        if self.enabled:
+            try:
+                r, _, _ = select.select([self._fd, self._wake_r], [], [], timeout)
+                if self._wake_r in r:
+                    os.read(self._wake_r, 4096)
+                if self._fd not in r:
+                    return b''
+                # in_waiting is only a lower bound; socket:// reports 1
+                # however much is buffered, so read until it drops to 0
+                b = bytearray(self.serial.read(self.serial.in_waiting or 1))
+                n = self.serial.in_waiting
+                while n and len(b) < max_n:
+                    b += self.serial.read(min(n, max_n - len(b)))
+                    n = self.serial.in_waiting
+                return bytes(b)
+            except (serial.SerialException, OSError) as e:
+                self.enabled = False
+                self.handleException(e)
+        return b''
+
+    def wakeRead(self):
+        # Make readBlock or readAvailable return early
+        if self.enabled:
+            try:
+                if self._wake_w is not None:
+                    os.write(self._wake_w, b'\x00')
+                elif hasattr(self.serial, 'cancel_read'):
+                    # Nothing to select on, cancelling is the only way
+                    self.serial.cancel_read()
+            except BlockingIOError:
+                # A wake up is already pending
+                pass
+            except (serial.SerialException, OSError) as e:
+                self.enabled = False
+                self.handleException(e)
 
 class CenturionTerm(object):
     CMD_FLUSH = -2
     CMD_QUIT = -255
 
+    # Output states index the parser tables, so they must stay contiguous
     OSTATE_NORMAL = 0
-    OSTATE_ESCAPE = 10
-    OSTATE_CUR_ABS_1 = 20
-    OSTATE_CUR_ABS_2 = 30
-    OSTATE_CUS_HORZ = 40
-    OSTATE_CUR_VERT = 50
-    OSTATE_DATA_CHAR = 60
+    OSTATE_ESCAPE = 1
+    OSTATE_CUR_ABS_1 = 2
+    OSTATE_CUR_ABS_2 = 3
+    OSTATE_CUS_HORZ = 4
+    OSTATE_CUR_VERT = 5
+    OSTATE_DATA_CHAR = 6
+    OSTATE_COUNT = 7
+
+    # Output actions, index _actions
+    OACTION_NONE = 0
+    OACTION_EMIT = 1
+    OACTION_EMIT_CHAR = 2
+    OACTION_EMIT_CONTROL = 3
+    OACTION_EMIT_DELETE = 4
+    OACTION_EMIT_DARK_SHADE = 5
+    OACTION_BEEP = 6
+    OACTION_CURSOR_BACK = 7
+    OACTION_CURSOR_DOWN = 8
+    OACTION_CURSOR_FORWARD = 9
+    OACTION_CURSOR_HOME = 10
+    OACTION_CURSOR_UP = 11
+    OACTION_ERASE_ALL = 12
+    OACTION_LINE_START = 13
+    OACTION_ERASE_END_OF_LINE = 14
+    OACTION_ERASE_END_OF_PAGE = 15
+    OACTION_CUR_ABS_1 = 16
+    OACTION_CUR_ABS_2 = 17
+    OACTION_CUS_HORZ = 18
+    OACTION_CUR_VERT = 19
 
     def __init__(self, config, device):
         self.config = config
+        # Copied once so the cursor movers test a plain attribute
+        self.auto_scroll = config.get('auto_scroll', True)
         self.device = device
         self.device.registerExceptionHandler(self.deviceExceptionHandler)
         self._console_alive = False
-        self.out_q = queue.Queue()
+        # Local echo bytes; deque append/popleft are atomic, no lock needed
+        self.out_q = deque()
         self.scr = None
+        self._scr_ready = threading.Event()
+        self._input_ready = threading.Event()
         self.input_enabled = False
+        self._build_output_tables()
         # self.main_win = None
         # self.status_win = None
         signal.signal(signal.SIGINT, self.signal_handler_SIGINT)
@@ -166,7 +288,7 @@ class CenturionTerm(object):
         msg = "Communication Error: {}".format(str(e))
         logging.warning(msg)
         self.input_enabled = False
-        curses.halfdelay(1)
+        self._input_ready.clear()
         if self.scr:
             self.scroll()
             self.scroll()
@@ -175,7 +297,11 @@ class CenturionTerm(object):
             self.scr.addstr(23,0, "[Press ENTER to exit]", curses.A_BOLD)
             self.scr.refresh()
             curses.nocbreak()
-            self.scr.getch()
+            # do_input may be in getch as well and hand the key back
+            # with ungetch, so poll rather than block in read
+            self.scr.timeout(100)
+            while self.scr.getch() == -1:
+                pass
             self.stop()
         else:
             sys.exit(msg)
@@ -192,6 +318,7 @@ class CenturionTerm(object):
         self.input_thread.start()
 
         self.input_enabled = True
+        self._input_ready.set()
 
     def join(self):
         self.input_thread.join()
@@ -199,8 +326,18 @@ class CenturionTerm(object):
 
     def stop(self):
         self._console_alive = False
+        self._scr_ready.set()
+        self._input_ready.set()
         self.device.cancelRead()
 
+    def _bind_screen(self, scr):
+        self.scr = scr
+        # Bound once so the per byte handlers skip the self.scr lookup
+        self._getyx = scr.getyx
+        self._move = scr.move
+        self._addch = scr.addch
+        self._A_STANDOUT = curses.A_STANDOUT
+
     def logyx(self, func, msg=""):
         y, x = self.scr.getyx()
         logging.debug("{}: ({},{}) {}".format(func, y, x, msg))
@@ -208,254 +345,313 @@ class CenturionTerm(object):
     def scroll(self):
         # self.logyx("scroll", "Begin")
         save_y, save_x = self.scr.getyx()
-        
-        for y in range(1, 24):
-            # self.scr.move(y-1, 0)
-            for x in range(80):
-                ch = self.scr.inch(y, x)
-                self.scr.addch(y-1, x, ch & 0xFF, ch & 0xFFFFFF00)
 
-        self.scr.move(23, 0)
-        self.scr.clrtoeol()
-        self.scr.move(save_y, save_x)
+        # Let curses shift lines 0-23 itself; scrolling stays off
+        # otherwise so writes at the last cell never scroll the window
+        try:
+            self.scr.setscrreg(0, 23)
+            self.scr.scrollok(True)
+            self.scr.scroll(1)
+        except curses.error:
+            # Copy the text up a line at a time; attributes are lost.
+            # instr returns the row in the window's encoding, where the
+            # middle dot and dark shade take more than one byte
+            encoding = self.scr.encoding
+            for y in range(1, 24):
+                line = self.scr.instr(y, 0)
+                self.scr.addnstr(y-1, 0, line.decode(encoding, 'replace'), 80)
+            self.scr.move(23, 0)
+            self.scr.clrtoeol()
+        finally:
+            self.scr.scrollok(False)
+            self.scr.setscrreg(0, 24)
 
-        self.scr.redrawwin()
-        self.scr.refresh()
+        self.scr.move(save_y, save_x)
+        self.scr.noutrefresh()
 
     def addch(self, ch, attr=0):
         # self.logyx("addch", "Begin ch={}".format(ch))
-        y, x = self.scr.getyx()
+        y, x = self._getyx()
         if y == 23 and x == 79:
-            if self.config['auto_scroll']:
+            if self.auto_scroll:
                 self.moveCursorForward()
-                self.scr.addch(22, 79, ch, attr)
+                self._addch(22, 79, ch, attr)
             else:
-                self.scr.addch(23, 79, ch, attr)
-            self.scr.move(23, 0)
-            self.scr.refresh()
+                self._addch(23, 79, ch, attr)
+            self._move(23, 0)
         else:
-            self.scr.addch(y, x, ch, attr)
-            self.scr.move(y, x)
-            self.moveCursorForward()
+            self._addch(y, x, ch, attr)
+            # Where moveCursorForward would land, without asking curses
+            # again; not the bottom row's last cell, handled above
+            if x < 79:
+                self._move(y, x + 1)
+            else:
+                self._move(y + 1, 0)
+
+    def addstr(self, s):
+        # Write a run of plain characters, handing the bottom right
+        # corner to addch so auto scroll behaves the same. The cursor
+        # is tracked here rather than asked for after each line.
+        y, x = self._getyx()
+        i = 0
+        end = len(s)
+        while i < end:
+            n = 80 - x if y < 23 else 79 - x
+            if n <= 0:
+                self.addch(s[i])
+                i += 1
+                y, x = self._getyx()
+            else:
+                self.scr.addstr(s[i:i+n])
+                i += n
+                x += n
+                if x >= 80:
+                    y += 1
+                    x = 0
 
     def moveCursorBack(self):
         # self.logyx("moveCursorBack", "Begin")
-        y, x = self.scr.getyx()
+        y, x = self._getyx()
         if x == 0 and y == 0:
-            self.scr.move(23, 79)
+            self._move(23, 79)
         elif x == 0:
-            self.scr.move(y-1, 79)
+            self._move(y-1, 79)
         else:
-            self.scr.move(y, x-1)
-        self.scr.refresh()
+            self._move(y, x-1)
 
     def moveCursorDown(self):
         # self.logyx("moveCursorDown", "Begin")
-        y, x = self.scr.getyx()
+        y, x = self._getyx()
         # eprint("y="+str(y)+", x="+str(x))
         if y >= 23:
-            if self.config['auto_scroll']:
+            if self.auto_scroll:
                 self.scroll()
-                self.scr.move(23, x)
+                self._move(23, x)
             else:
-                self.scr.move(0, x)
+                self._move(0, x)
         else:
-            self.scr.move(y+1, x)
-        self.scr.refresh()
+            self._move(y+1, x)
 
     def moveCursorForward(self):
         # self.logyx("moveCursorForward", "Begin")
-        y, x = self.scr.getyx()
+        y, x = self._getyx()
         if x >= 79:
             if y >= 23:
                 # I'm unsure what the actual terminal does
                 # here and the manual isn't clear
-                if self.config['auto_scroll']:
+                if self.auto_scroll:
                     self.scroll()
-                self.scr.move(23, 0)
+                self._move(23, 0)
             else:
-                self.scr.move(y+1, 0)
+                self._move(y+1, 0)
         else:
-            self.scr.move(y, x+1)
-        self.scr.refresh()
+            self._move(y, x+1)
 
     def moveCursorHome(self):
-        if self.config['auto_scroll']:
-            self.scr.move(23, 0) # Lower Left
+        if self.auto_scroll:
+            self._move(23, 0) # Lower Left
         else:
-            self.scr.move(0, 0) # Upper Left
-        self.scr.refresh()
+            self._move(0, 0) # Upper Left
 
     def moveCursorUp(self):
         # self.logyx("moveCursorUp", "Begin")
-        y, x = self.scr.getyx()
+        y, x = self._getyx()
         if y == 0:
-            self.scr.move(23, x)
+            self._move(23, x)
         else:
-            self.scr.move(y-1, x)
-        self.scr.refresh()
+            self._move(y-1, x)
 
     def moveCursor(self, y, x):
         # self.logyx("moveCursor", "Begin to ({},{})".format(y,x))
         if y < 24 and x < 80:
-            self.scr.move(y, x)
-            self.scr.refresh()
+            self._move(y, x)
 
     def moveCursorHorz(self, a):
-        y, _ = self.scr.getyx()
+        y, _ = self._getyx()
         a = a & 0x7F
         group = a >> 4
         pos = a & 0xF
         if pos < 10:
-            self.scr.move(y, group * 10 + pos)
-            self.scr.refresh()
+            self._move(y, group * 10 + pos)
 
     def moveCursorVert(self, a):
-        _, x = self.scr.getyx()
+        _, x = self._getyx()
         a = a & 0x1F
         if a < 24:
-            self.scr.move(a, x)
-            self.scr.refresh()
+            self._move(a, x)
 
     def eraseAll(self):
         self.scr.clear()
-        self.scr.refresh()
 
     def moveCursorLineStart(self):
-        y, x = self.scr.getyx()
-        self.scr.move(y, 0)
-        self.scr.refresh()
+        y, x = self._getyx()
+        self._move(y, 0)
 
     def newLine(self):
         pass
 
     def eraseEndOfLine(self):
         self.scr.clrtoeol()
-        self.scr.refresh()
 
     def eraseEndOfPage(self):
         self.scr.clrtobot()
-        self.scr.refresh()
+
+    def _emit(self, ch):
+        # Printable ASCII goes to curses as an int, no string needed
+        self.addch(ch)
+
+    def _emit_char(self, ch):
+        self.addch(CHR_TABLE[ch])
+
+    def _emit_control(self, ch):
+        self.addch(ch + 64, self._A_STANDOUT)
+
+    def _emit_delete(self, ch):
+        #self.addch(chr(0x2593)) #  ▓ Dark Shade
+        self._addch(0x20)
+        self._addch(0x08)
+
+    def _emit_dark_shade(self, ch):
+        self.addch(DARK_SHADE)
+
+    def _cur_abs_1(self, ch):
+        # ESC Y sends the column first, then the row
+        self._cur_abs_x = ch
+
+    def _cur_abs_2(self, ch):
+        self.moveCursor(ch, self._cur_abs_x)
+
+    def _build_output_tables(self):
+        # The output parser is a DFA: for state s and byte ch, entry
+        # s << 8 | ch of _next_state and _action gives the state to move
+        # to and the action to run. Bytes not listed go back to
+        # OSTATE_NORMAL with no action.
+        self._next_state = next_state = bytearray(self.OSTATE_COUNT << 8)
+        self._action = action = bytearray(self.OSTATE_COUNT << 8)
+
+        def on(state, chars, act, to=self.OSTATE_NORMAL):
+            for ch in chars:
+                next_state[state << 8 | ch] = to
+                action[state << 8 | ch] = act
+
+        def call(func):
+            # Actions take the byte; most commands don't need it
+            return lambda ch: func()
+
+        # In OACTION_* order
+        self._actions = (
+            None,
+            self._emit,
+            self._emit_char,
+            self._emit_control,
+            self._emit_delete,
+            self._emit_dark_shade,
+            call(curses.beep),
+            call(self.moveCursorBack),
+            call(self.moveCursorDown),
+            call(self.moveCursorForward),
+            call(self.moveCursorHome),
+            call(self.moveCursorUp),
+            call(self.eraseAll),
+            call(self.moveCursorLineStart),
+            call(self.eraseEndOfLine),
+            call(self.eraseEndOfPage),
+            self._cur_abs_1,
+            self._cur_abs_2,
+            self.moveCursorHorz,
+            self.moveCursorVert,
+        )
+
+        state = self.OSTATE_NORMAL
+        on(state, range(0x00, 0x20), self.OACTION_EMIT_CONTROL)
+        on(state, range(0x20, 0x7F), self.OACTION_EMIT)
+        on(state, [0x1B], self.OACTION_NONE, self.OSTATE_ESCAPE) # ESC
+        on(state, [0x10], self.OACTION_NONE, self.OSTATE_CUS_HORZ) # DLE, Cursor Move Horizontal
+        on(state, [0x0B], self.OACTION_NONE, self.OSTATE_CUR_VERT) # VT, Cursor Move Vertical
+        on(state, [0x07], self.OACTION_BEEP) # BEL, Audible Tone
+        on(state, [0x14], self.OACTION_EMIT_CHAR) # DC4, AUX port OFF TODO
+        on(state, [0x12], self.OACTION_EMIT_CHAR) # DC2, AUX port ON TODO
+        on(state, [0x08, 0x15], self.OACTION_CURSOR_BACK) # BS, NAK, Backspace / Cursor Back
+        on(state, [0x0A], self.OACTION_CURSOR_DOWN) # LF, Cursor Down
+        on(state, [0x06], self.OACTION_CURSOR_FORWARD) # ACK, Cursor Forward
+        on(state, [0x01], self.OACTION_CURSOR_HOME) # SOA, Cursor Home
+        on(state, [0x1A], self.OACTION_CURSOR_UP) # SUB, Cursor Up
+        on(state, [0x0C], self.OACTION_ERASE_ALL) # FF, Erase All
+        on(state, [0x0D], self.OACTION_LINE_START) # CR, Carriage Return
+        on(state, [0x04], self.OACTION_NONE) # EOT, Keyboard Lock (only when the keyboard lock option is enabled) TODO
+        on(state, [0x02], self.OACTION_NONE) # STX, Keyboard Unlock (only when the keyboard lock option is enabled) TODO
+        on(state, [0x7F], self.OACTION_EMIT_DELETE) # DEL
+        on(state, [0x00], self.OACTION_EMIT_CHAR) # · Middle Dot
+
+        state = self.OSTATE_ESCAPE
+        on(state, [0x59], self.OACTION_NONE, self.OSTATE_CUR_ABS_1) # 'Y', Cursor Move Absolute
+        on(state, [0x4B], self.OACTION_ERASE_END_OF_LINE) # 'K', Erase to End of Line
+        on(state, [0x6B], self.OACTION_ERASE_END_OF_PAGE) # 'k', Erase to End of Page
+        # '5', '6' Keyboard Lock / Unlock (only when the keyboard lock option is disabled) TODO
+        # '4', '3' Transparent Print OFF / ON TODO
+        # 'Z', Store Control Character
+        # This command causes the characters which follow the command code
+        # to be considered as a data character and not acted upon by the
+        # terminal, regardles of its location on the ASCII chart.
+        on(state, [0x5A], self.OACTION_NONE, self.OSTATE_DATA_CHAR)
+
+        on(self.OSTATE_CUR_ABS_1, range(256), self.OACTION_CUR_ABS_1, self.OSTATE_CUR_ABS_2)
+        on(self.OSTATE_CUR_ABS_2, range(256), self.OACTION_CUR_ABS_2)
+        on(self.OSTATE_CUS_HORZ, range(256), self.OACTION_CUS_HORZ)
+        on(self.OSTATE_CUR_VERT, range(256), self.OACTION_CUR_VERT)
+
+        state = self.OSTATE_DATA_CHAR
+        on(state, range(0x00, 0x20), self.OACTION_EMIT_CONTROL)
+        on(state, range(0x20, 0x7F), self.OACTION_EMIT)
+        on(state, range(0x80, 0x100), self.OACTION_EMIT_CHAR)
+        on(state, [0x00], self.OACTION_EMIT_CHAR) # · Middle Dot
+        on(state, [0x7F], self.OACTION_EMIT_DARK_SHADE) # ▓ Dark Shade
 
     def translate_output(self, ch):
-        outch = None
-        attr = 0
-
-        if self.oState == self.OSTATE_NORMAL:
-            if ch == 0x1B: # ESC
-                self.oState = self.OSTATE_ESCAPE
-            elif ch == 0x10: # DLE, Cursor Move Horizontal
-                self.oState = self.OSTATE_CUS_HORZ
-            elif ch == 0x0B: # VT, Cursor Move Vertical
-                self.oState = self.OSTATE_CUR_VERT
-            elif ch == 0x07: # BEL, Audible Tone
-                curses.beep()
-            elif ch == 0x14: # DC4, AUX port OFF
-                # TODO
-                outch = ch
-            elif ch == 0x12: # DC2, AUX port ON
-                # TODO
-                outch = ch
-            elif ch == 0x08 or ch == 0x15: # BS, NAK, Backspace / Cursor Back
-                self.moveCursorBack()
-            elif ch == 0x0A: # LF, Cursor Down
-                self.moveCursorDown()
-            elif ch == 0x06: # ACK, Cursor Forward
-                self.moveCursorForward()
-            elif ch == 0x01: # SOA, Cursor Home
-                self.moveCursorHome()
-            elif ch == 0x1A: # SUB, Cursor Up
-                self.moveCursorUp()
-            elif ch == 0x0C: # FF, Erase All
-                self.eraseAll()
-            elif ch == 0x0D: # CR, Carriage Return
-                self.moveCursorLineStart()
-            elif ch == 0x04: # EOT, Keyboard Lock (only when the keyboard lock option is enabled)
-                # TODO
-                pass
-            elif ch == 0x02: # STX, Keyboard Unlock (only when the keyboard lock option is enabled)
-                # TODO
-                pass
-            elif ch == 0x7F: # DEL
-                #outch = 0x2593 #  ▓ Dark Shade
-                self.scr.addstr(" \x08")
-                self.scr.refresh()
-            elif ch == 0x00:
-                outch = 0xB7 # · Middle Dot
-            elif ch >= 32 and ch < 127:
-                outch = ch
-            elif ch < 32:
-                attr = curses.A_STANDOUT
-                outch = ch + 64
-
-        elif self.oState == self.OSTATE_ESCAPE:
-            if ch == 0x59: # 'Y', Cursor Move Absolute
-                self.escape_args = []
-                self.oState = self.OSTATE_CUR_ABS_1
-            elif ch == 0x4B: # 'K', Erase to End of Line
-                self.eraseEndOfLine()
-                self.oState = self.OSTATE_NORMAL
-            elif ch == 0x6B: # 'k', Erase to End of Page
-                self.eraseEndOfPage()
-                self.oState = self.OSTATE_NORMAL
-            elif ch == 0x35: # '5', Keyboard Lock (only when the keyboard lock option is disabled)
-                # TODO
-                self.oState = self.OSTATE_NORMAL
-            elif ch == 0x36: # '6', Keyboard Unlock (only when the keyboard lock option is disabled)
-                # TODO
-                self.oState = self.OSTATE_NORMAL
-            elif ch == 0x5A: # 'Z', Store Control Character
-                # This command causes the characters which follow the command code
-                # to be considered as a data character and not acted upon by the
-                # terminal, regardles of its location on the ASCII chart.
-                self.oState = self.OSTATE_DATA_CHAR
-            elif ch == 0x34: # '4', Transparent Print OFF
-                # TODO
-                self.oState = self.OSTATE_NORMAL
-            elif ch == 0x33: # '3', Transparent Print ON
-                # TODO
-                self.oState = self.OSTATE_NORMAL
-            else:
-                self.oState = self.OSTATE_NORMAL
-        elif self.oState == self.OSTATE_CUR_ABS_1:
-            self.escape_args.append(ch)
-            self.oState = self.OSTATE_CUR_ABS_2
-        elif self.oState == self.OSTATE_CUR_ABS_2:
-            self.escape_args.append(ch)
-            self.moveCursor(self.escape_args[1], self.escape_args[0])
-            self.oState = self.OSTATE_NORMAL
-        elif self.oState == self.OSTATE_CUS_HORZ:
-            self.moveCursorHorz(ch)
-            self.oState = self.OSTATE_NORMAL
-        elif self.oState == self.OSTATE_CUR_VERT:
-            self.moveCursorVert(ch)
-            self.oState = self.OSTATE_NORMAL
-        elif self.oState == self.OSTATE_DATA_CHAR:
-            if ch == 0:
-                outch = 0xB7 # · Middle Dot
-            elif ch < 32:
-                attr = curses.A_STANDOUT
-                outch = ch + 64
-            elif ch == 127:
-                outch = 0x2593 # ▓ Dark Shade
-            else:
-                outch = ch
-            self.oState = self.OSTATE_NORMAL
-        else:
-            # Error Unknown State
-            outch = ch
-            self.oState = self.OSTATE_NORMAL
-        
-        if outch is not None:
-            self.addch(chr(outch), attr)
+        # Plain text is the common case; skip the tables for it
+        if self.oState == self.OSTATE_NORMAL and 32 <= ch < 127:
+            self.addch(ch)
+            return
+        idx = self.oState << 8 | ch
+        self.oState = self._next_state[idx]
+        act = self._action[idx]
+        if act:
+            self._actions[act](ch)
+
+    def feed(self, chunk):
+        # Run the parser over a whole buffer without a call per byte,
+        # drawing runs of plain text with a single addstr
+        next_state = self._next_state
+        action = self._action
+        actions = self._actions
+        state = self.oState
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if state == self.OSTATE_NORMAL:
+                run = PRINTABLE_RUN.match(chunk, i)
+                if run is not None:
+                    i = run.end()
+                    self.addstr(run.group().translate(NUL_TO_MIDDLE_DOT).decode('latin-1'))
+                    continue
+            ch = chunk[i]
+            idx = state << 8 | ch
+            state = next_state[idx]
+            act = action[idx]
+            if act:
+                actions[act](ch)
+            i += 1
+        self.oState = state
 
     def do_output(self, scr):
         self.oState = self.OSTATE_NORMAL
-        self.escape_args = []
+        self._cur_abs_x = 0
 
         curses.raw()
+        # Keep signals on so Ctrl-C reaches signal_handler_SIGINT, as
+        # it did when halfdelay() was still switching to cbreak here
+        curses.cbreak()
         curses.resize_term(25, 80)
-        curses.halfdelay(10)
         curses.start_color()
         #curses.nonl()
         #curses.use_default_colors()
@@ -486,79 +682,108 @@ class CenturionTerm(object):
         scr.scrollok(False)
         scr.setscrreg(0, 24)
         scr.resize(25, 80)
-        self.scr = scr
+        self._bind_screen(scr)
+        self._scr_ready.set()
+
+        # Bind the loop's lookups once; _console_alive is still read
+        # each pass since stop() clears it from another thread
+        readBlock = self.device.readBlock
+        out_q = self.out_q
+        get_echo = out_q.popleft
+        translate_output = self.translate_output
+        feed = self.feed
+        noutrefresh = scr.noutrefresh
+        doupdate = curses.doupdate
 
         while self._console_alive:
-            ch = self.device.readByte()
+            # Block until data arrives; stop() and local echo wake us
+            chunk = readBlock(None)
 
             # Try and echo characters if enabled
-            try:
-                while(True):
-                    echo_ch = self.out_q.get_nowait()
-                    self.translate_output(echo_ch)
-            except queue.Empty:
-                pass
+            while out_q:
+                translate_output(get_echo())
 
-            if ch >= 0:
-                # print("[" + str(ch) + "]")
-                self.translate_output(ch)
+            feed(chunk)
+
+            # Push everything drawn for this chunk to the terminal at once
+            noutrefresh()
+            doupdate()
 
         self._console_alive = False
 
+    # Bytes sent for each key; curses.KEY_* values are defined at import
+    INPUT_MAP = {ch: (ch,) for ch in range(128)}
+    INPUT_MAP.update({
+        0x0A: (0x0D,),
+        curses.KEY_DOWN: (0x0A,), # LF, Cursor Down
+        curses.KEY_UP: (0x1A,), # SUB, Cursor Up
+        curses.KEY_LEFT: (0x15,), # NAK, Backspace / Cursor Back
+        curses.KEY_RIGHT: (0x06,), # ACK, Cursor Forward
+        curses.KEY_HOME: (0x01,), # SOA, Cursor Home
+        curses.KEY_CLEAR: (0x0C,), # FF, Erase All
+        curses.KEY_DC: (0x7F,), # DEL
+        curses.KEY_BACKSPACE: (0x08,), # BS
+    })
+
     def translate_input(self, ch):
-        if ch == 0x0A:
-            return [0x0D]
-        elif ch >= 0 and ch <= 127:
-            return [ch]
-        elif ch == curses.KEY_DOWN:
-            return [0x0A] # LF, Cursor Down          
-        elif ch == curses.KEY_UP:
-            return [0x1A] # SUB, Cursor Up
-        elif ch == curses.KEY_LEFT:
-            return [0x15] # NAK, Backspace / Cursor Back
-        elif ch == curses.KEY_RIGHT:
-            return [0x06] # ACK, Cursor Forward
-        elif ch == curses.KEY_HOME:
-            return [0x01] # SOA, Cursor Home
-        elif ch == curses.KEY_CLEAR:
-            return [0x0C] # FF, Erase All
-        elif ch == curses.KEY_DC:
-            return [0x7F] # DEL
-        elif ch == curses.KEY_BACKSPACE:
-            return [0x08] # BS
-        elif ch == -1:
-            pass
-        elif ch == curses.KEY_F10:
+        result = self.INPUT_MAP.get(ch)
+        if result is None and ch == curses.KEY_F10:
             self.stop()
-
-        return None
+        return result
 
     def do_input(self):
+        # Wait for do_output to set up the screen; it stays the same
+        # window for the rest of the session
+        self._scr_ready.wait()
+
+        scr = self.scr
+        translate_input = self.translate_input
+        writeBytes = self.device.writeBytes
+        wakeRead = self.device.wakeRead
+        put_echo = self.out_q.extend
+        echo = self.config['echo']
+
+        # An ungetch from another thread, as signal_handler_SIGINT does,
+        # does not end a getch already blocked in read, so wake up every
+        # 50ms to pick such keys up and to notice stop()
+        scr.timeout(50)
 
         while self._console_alive:
-            if self.scr is not None and self.input_enabled:
+            if self.input_enabled:
                 try:
-                    input = self.scr.getch()
+                    input = scr.getch()
                 except curses.error:
                     continue
-                
-                # if input was disabled while in getch
-                # put character back
-                if not self.input_enabled: 
-                    if input >= 0 and input <= 255:
-                        curses.ungetch(input)
-                    continue
-
-                result = self.translate_input(input)
 
-                if result is not None:
-                    for ch in result:
-                        if self.config['echo']:
-                            self.out_q.put(ch)
-                            self.device.cancelRead()
-                        self.device.writeByte(ch)
+                buf = bytearray()
+
+                # Drain keys that are already pending so fast typing or
+                # a paste goes out in one write
+                scr.timeout(0)
+                while input != -1 and self._console_alive:
+                    # if input was disabled while in getch
+                    # put character back
+                    if not self.input_enabled: 
+                        if input >= 0 and input <= 255:
+                            curses.ungetch(input)
+                        break
+
+                    result = translate_input(input)
+
+                    if result is not None:
+                        buf.extend(result)
+
+                    input = scr.getch()
+                scr.timeout(50)
+
+                if buf:
+                    if echo:
+                        put_echo(buf)
+                        # One wake up for the whole batch
+                        wakeRead()
+                    writeBytes(bytes(buf))
             else:
-                time.sleep(0.5)
+                self._input_ready.wait()
 
     # def resize_handler(self, signum, frame):
     #     if self.main_win is not None:
@@ -570,12 +795,28 @@ class CenturionTerm(object):
         # signal(signal.SIGWINCH, self.resize_handler)
         curses.wrapper(self.do_output)
         self.scr = None
+        self._scr_ready.clear()
 
 
+# Config options that hold ON/OFF style booleans
+NEEDS_TRUTHYFYING = frozenset((
+    'normal_case_upper',
+    'keyboard_lock_compatability',
+    'auto_scroll',
+    'echo',
+    'xonxoff_flowcontrol',
+    'rtscts_flowcontrol',
+    'initial_dtr',
+    'initial_rts',
+    'exclusive',
+))
+
+# Config values that mean ON, compared after strip().upper()
+TRUTHY = frozenset(('ON', 'TRUE', 'YES', '1', 'Y', 'T'))
+
 def configTruthyfy(s):
     if isinstance(s, str):
-        s = s.strip().upper()
-        return s == 'ON' or s == 'TRUE' or s == 'YES'
+        return s.strip().upper() in TRUTHY
     elif isinstance(s, bool):
         return s
     else:
@@ -728,7 +969,9 @@ def parseArguments():
         action=BooleanOptionalAction,
         help='locking for native ports')
 
-    return vars(parser.parse_args())
+    # Options left unset come back as None; drop them so they don't
+    # override the config file
+    return {k: v for k, v in vars(parser.parse_args()).items() if v is not None}
 
 def parseConfig(config_file):
     config = ConfigParser()
@@ -758,26 +1001,10 @@ def main():
         'exclusive': True, 
     }
 
-    needs_truthyfying = [
-        'normal_case_upper', 
-        'keyboard_lock_compatability', 
-        'auto_scroll', 
-        'echo', 
-        'xonxoff_flowcontrol', 
-        'rtscts_flowcontrol', 
-        'initial_dtr', 
-        'initial_rts', 
-        'exclusive',         
-    ]
-
     args = parseArguments()
 
-    for key, value in dict(args).items():
-        if value is None:
-            del args[key]
-
     # If the arguments include --no-config, skip parsing Config
-    if 'no_config' not in args or args['no_config'] == False:
+    if not args.get('no_config'):
         c = parseConfig(args['config'])
 
         config = c['general']
@@ -789,9 +1016,7 @@ def main():
         config = config_defaults | args
 
     # Convert ON, OFF, etc to real booleans
-    for key, value in dict(config).items():
-        if key in needs_truthyfying:
-            config[key] = configTruthyfy(value)
+    config = {k: configTruthyfy(v) if k in NEEDS_TRUTHYFYING else v for k, v in config.items()}
 
     # Check some values
 